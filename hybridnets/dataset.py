@@ -81,7 +81,10 @@ class BddDataset(Dataset):
             image_path = label_path.replace(str(self.label_root), str(self.img_root)).replace(".json", ".jpg")
             seg_path = {}
             for i in range(len(self.seg_list)):
-                seg_path[self.seg_list[i]] = label_path.replace(str(self.label_root), str(self.seg_root[i])).replace(".json", ".jpg")
+                seg_file = Path(label_path.replace(str(self.label_root), str(self.seg_root[i]))).with_suffix(".png")
+                if not seg_file.exists():  # masks from older exports are .jpg
+                    seg_file = seg_file.with_suffix(".jpg")
+                seg_path[self.seg_list[i]] = str(seg_file)
                 # seg_path[self.seg_list[i]] = cv2.imread(label_path.replace(str(self.label_root), str(self.seg_root[i])).replace(".json", ".png"), 0)
             with open(label_path, 'r') as f:
                 label = json.load(f)
@@ -5,17 +5,32 @@ Image segmentation script for lanes and roads.
 - Creates `output/lanes` and `output/roads` directories if they don't exist.
 - Detects light-purple lane markings and outputs a binary mask where lanes are white and everything else is black.
 - Detects cyan road regions and outputs a mask where roads are grey and everything else is black.
+- Masks are written as lossless single-channel PNGs named after the input image.
+
+Images are decoded, segmented and re-encoded in parallel by N_PROCESSES worker processes
+(one per CPU core by default), in batches of BATCH_SIZE. Pixels are classified, in cache-sized
+strips, through a precomputed BGR -> {lane, road, neither} table that replaces the per-pixel
+HSV conversion. The encoded masks are written to disk by a small thread pool
+in the parent so disk I/O overlaps with segmentation. Setting USE_CUDA (with a CUDA-enabled
+OpenCV build and a visible GPU) instead classifies batches on the device in a single process.
 
 Adjust HSV ranges below if your dataset uses slightly different colors.
-Requires: opencv-python, numpy
+Requires: opencv-python, numpy, tqdm
 """
 
+import multiprocessing as mp
+import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
 from pathlib import Path
-from typing import Tuple
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 
 import cv2
 import numpy as np
+from tqdm import tqdm
 
 # Directories
 INPUT_DIR = Path("input")
@@ -23,9 +38,11 @@ OUTPUT_DIR = Path("output")
 LANES_DIR = OUTPUT_DIR / "lanes"
 ROADS_DIR = OUTPUT_DIR / "roads"
 
-# Output colors (BGR)
-WHITE: Tuple[int, int, int] = (255, 255, 255)
-GREY: Tuple[int, int, int] = (128, 128, 128)
+# Grey level of road pixels (lane masks are written as 1-bit PNGs, so lanes are always white)
+GREY = 128
+
+# Fast zlib level; near-binary masks compress well regardless
+PNG_COMPRESSION = 1
 
 # HSV thresholds (OpenCV HSV: H ∈ [0,179], S ∈ [0,255], V ∈ [0,255])
 # Yellow (lanes) — tune if needed
@@ -36,8 +53,93 @@ LANE_UPPER = np.array([35, 255, 255], dtype=np.uint8)
 ROAD_LOWER = np.array([125, 40, 120], dtype=np.uint8)
 ROAD_UPPER = np.array([160, 255, 255], dtype=np.uint8)
 
+# Pixel classes stored in the BGR lookup table, with their HSV (lower, upper) bounds
+# stacked into one contiguous (2, 3) array each
+LANE_CLASS = 1
+ROAD_CLASS = 2
+CLASS_BOUNDS = {
+    LANE_CLASS: np.stack([LANE_LOWER, LANE_UPPER]),
+    ROAD_CLASS: np.stack([ROAD_LOWER, ROAD_UPPER]),
+}
+
+# Images are classified in horizontal strips whose working set (BGR in, BGRA index,
+# class map, two mask rows: ~10 bytes per pixel) fits in a typical L2 cache
+STRIP_CACHE_BYTES = 1 << 20
+STRIP_BYTES_PER_PIXEL = 10
+
 # Morphology kernel
 KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+# Open+close is erode(K), dilate(K), dilate(K), erode(K); the two middle dilations
+# fold into one with K dilated by itself, saving a full pass over the mask
+KERNEL_TWICE = cv2.dilate(np.pad(KERNEL, 1), KERNEL)
+# Context around a mask's bounding box that makes the cropped open+close exact
+# (one pixel per erode/dilate that can reach outside the box)
+MORPH_PAD = 2
+
+# Opt in to classifying on the GPU (HSV conversion + range check) in a single process.
+# Decode, morphology and encode then run serially in the parent, so on a multi-core
+# machine the CPU process pool is usually faster.
+USE_CUDA = False
+
+# Worker processes, and images handed to a worker per task
+N_PROCESSES = os.cpu_count() or 1
+BATCH_SIZE = 8
+
+# File reads each process keeps in flight while it decodes the images already read
+READ_THREADS = 4
+
+# Background writers and the max number of file writes in flight before the parent blocks
+WRITE_THREADS = 4
+WRITE_QUEUE_DEPTH = 64
+
+# (source image, lane mask, road mask) path strings, built once in main(), and a
+# task's encoded lane and road PNGs
+Task = Tuple[str, str, str]
+Result = Tuple[Task, np.ndarray, np.ndarray]
+
+# Per-process output buffers, reused across images of the same shape
+_BUFFERS: Dict[str, np.ndarray] = {}
+
+# Per-process read-ahead thread pool, created on first use (i.e. after the fork)
+_READER: Optional[ThreadPoolExecutor] = None
+
+
+def build_color_lut() -> np.ndarray:
+    """Classify every 24-bit BGR color once with the HSV thresholds above.
+
+    The table is indexed by ``b | g << 8 | r << 16`` (the first three bytes of a
+    little-endian BGRA pixel) and holds LANE_CLASS, ROAD_CLASS or 0.
+    """
+    # All 2^24 colors as a 4096x4096 BGRA image
+    cube = np.arange(1 << 24, dtype=np.uint32).view(np.uint8).reshape(4096, 4096, 4)
+    hsv = cv2.cvtColor(cv2.cvtColor(cube, cv2.COLOR_BGRA2BGR), cv2.COLOR_BGR2HSV)
+    lut = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    for cls, (lower, upper) in CLASS_BOUNDS.items():
+        lut |= cv2.bitwise_and(cv2.inRange(hsv, lower, upper), cls)
+    return lut.reshape(-1)
+
+
+# 16 MB, built once at import and shared copy-on-write with forked workers
+COLOR_LUT = build_color_lut()
+
+
+def check_opencv_build() -> None:
+    """Turn on OpenCV's optimized code paths and report the SIMD features the build was compiled for."""
+    cv2.setUseOptimized(True)
+    features = []
+    for line in cv2.getBuildInformation().splitlines():
+        label, _, value = line.strip().partition(":")
+        if label in ("Baseline", "Dispatched code generation"):
+            print(f"OpenCV {label}: {' '.join(value.split()) or 'none'}")
+            features += value.split()
+    if not features:
+        print("Warning: OpenCV was built without SIMD code paths; segmentation will be slow. "
+              "Rebuild opencv-python with SIMD enabled (e.g. -DCPU_DISPATCH=AVX2,AVX512_SKX).")
+
+
+def init_worker() -> None:
+    """Split the cores between worker processes so their OpenCV thread pools don't oversubscribe them."""
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // N_PROCESSES))
 
 
 def ensure_dirs() -> None:
@@ -45,47 +147,187 @@ def ensure_dirs() -> None:
     ROADS_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def make_mask(hsv_img: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
-    """Create a cleaned binary mask for the HSV range."""
-    raw = cv2.inRange(hsv_img, lower, upper)
-    # Clean small speckles; adjust iterations if needed
-    opened = cv2.morphologyEx(raw, cv2.MORPH_OPEN, KERNEL, iterations=1)
-    closed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, KERNEL, iterations=1)
-    return closed
+def clean_mask(raw: np.ndarray) -> np.ndarray:
+    """Remove speckles from a single image's binary mask, in place."""
+    # Masks are sparse, so only clean the bounding box of the detected pixels plus
+    # MORPH_PAD pixels of context; everything outside it stays zero either way.
+    x, y, w, h = cv2.boundingRect(raw)
+    if w == 0 or h == 0:
+        return raw
+    img_h, img_w = raw.shape
+    box = (slice(max(y - MORPH_PAD, 0), min(y + h + MORPH_PAD, img_h)),
+           slice(max(x - MORPH_PAD, 0), min(x + w + MORPH_PAD, img_w)))
+    roi = raw[box]
+    # The eroded mask goes to a full-frame scratch buffer (stable shape, so it is reused
+    # across images); the remaining passes write straight back into the mask.
+    eroded = get_buffer("eroded", raw.shape)[box]
+    # Clean small speckles: morphological open followed by close, in three passes
+    cv2.erode(roi, KERNEL, dst=eroded)
+    cv2.dilate(eroded, KERNEL_TWICE, dst=roi)
+    cv2.erode(roi, KERNEL, dst=roi)
+    return raw
+
+
+def get_buffer(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """Return a uint8 scratch buffer of the given shape, reallocating only when the shape changes."""
+    buf = _BUFFERS.get(name)
+    if buf is None or buf.shape != shape:
+        buf = _BUFFERS[name] = np.empty(shape, dtype=np.uint8)
+    return buf
+
+
+def get_reader() -> ThreadPoolExecutor:
+    """Return this process's read-ahead thread pool."""
+    global _READER
+    if _READER is None:
+        _READER = ThreadPoolExecutor(max_workers=READ_THREADS)
+    return _READER
+
+
+def read_bytes(img_path: str) -> Optional[np.ndarray]:
+    """Read a file's raw bytes; None if it is missing or empty. Releases the GIL while reading."""
+    try:
+        data = np.fromfile(img_path, dtype=np.uint8)
+    except OSError:
+        return None
+    return data if data.size else None
+
+
+def decode_image(data: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Decode raw file bytes to a BGR image; None if there are none or they aren't an image."""
+    if data is None:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def classify(bgr: np.ndarray, buffer_rows: int) -> np.ndarray:
+    """Map each BGR pixel to its class through COLOR_LUT, skipping the HSV image entirely.
+
+    Scratch buffers are sized for ``buffer_rows`` rows so strips of varying height share them.
+    """
+    h, w = bgr.shape[:2]
+    bgra = cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA, dst=get_buffer("bgra", (buffer_rows, w, 4))[:h])
+    index = bgra.view(np.uint32)[..., 0]
+    np.bitwise_and(index, 0xFFFFFF, out=index)  # drop alpha
+    return np.take(COLOR_LUT, index, out=get_buffer("classes", (buffer_rows, w))[:h], mode="clip")
+
+
+def range_masks(bgr: np.ndarray, use_cuda: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the raw 0/255 lane and road masks of a (possibly stacked) BGR image."""
+    if use_cuda:
+        return range_masks_cuda(bgr)
+    h, w = bgr.shape[:2]
+    lane_masks = get_buffer("lane_mask", (h, w))
+    road_masks = get_buffer("road_mask", (h, w))
+    # Every step is per pixel, so strips need no overlap; the intermediates of a strip
+    # stay in cache and only the final masks go back to memory.
+    rows = max(1, STRIP_CACHE_BYTES // (w * STRIP_BYTES_PER_PIXEL))
+    for y in range(0, h, rows):
+        strip = slice(y, min(y + rows, h))
+        classes = classify(bgr[strip], rows)
+        cv2.compare(classes, LANE_CLASS, cv2.CMP_EQ, dst=lane_masks[strip])
+        cv2.compare(classes, ROAD_CLASS, cv2.CMP_EQ, dst=road_masks[strip])
+    return lane_masks, road_masks
+
+
+def cuda_available() -> bool:
+    """True if OpenCV was built with CUDA and can see at least one device."""
+    return hasattr(cv2, "cuda") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+
+
+def range_masks_cuda(bgr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """GPU version of range_masks: one upload, HSV conversion and range checks on the device."""
+    gpu_img = cv2.cuda_GpuMat()
+    gpu_img.upload(bgr)
+    gpu_hsv = cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2HSV)
+    lane_lower, lane_upper = CLASS_BOUNDS[LANE_CLASS]
+    road_lower, road_upper = CLASS_BOUNDS[ROAD_CLASS]
+    lane_masks = cv2.cuda.inRange(gpu_hsv, tuple(lane_lower.tolist()), tuple(lane_upper.tolist())).download()
+    road_masks = cv2.cuda.inRange(gpu_hsv, tuple(road_lower.tolist()), tuple(road_upper.tolist())).download()
+    return lane_masks, road_masks
+
+
+def encode_masks(lane_mask: np.ndarray, road_mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode one image's cleaned masks as single-channel PNGs.
 
+    PNG is lossless, so black stays exactly 0 (JPEG speckle would turn into foreground
+    once the masks are thresholded), and deflate handles the flat masks far faster than
+    a DCT codec.
+    """
+    # Lanes (light purple -> white): the 0/255 mask already is the image, stored 1-bit
+    _, lane_buf = cv2.imencode(".png", lane_mask, [cv2.IMWRITE_PNG_BILEVEL, 1,
+                                                   cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
 
-def save_mask_as_color(mask: np.ndarray, color: Tuple[int, int, int]) -> np.ndarray:
-    """Return a BGR image where mask==255 is painted with color; else black."""
-    h, w = mask.shape[:2]
-    out = np.zeros((h, w, 3), dtype=np.uint8)
-    out[mask > 0] = color
-    return out
+    # Roads (cyan -> grey): ANDing the 0/255 mask with GREY paints it exactly, in place
+    road_grey = cv2.bitwise_and(road_mask, GREY, dst=road_mask)
+    _, road_buf = cv2.imencode(".png", road_grey, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+    return lane_buf, road_buf
 
 
-def process_image(img_path: Path) -> None:
-    img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
-    if img is None:
-        print(f"Warning: Could not read image: {img_path}")
-        return
+def process_batch(tasks: List[Task], use_cuda: bool = False) -> List[Optional[Result]]:
+    """Segment a batch of images; one result per task, None if its image couldn't be read."""
+    results: List[Optional[Result]] = []
+    loaded = []
+    # Queue every read up front so the disk works on the next files while this one decodes
+    reads = [get_reader().submit(read_bytes, task[0]) for task in tasks]
+    for task, read in zip(tasks, reads):
+        img = decode_image(read.result())
+        if img is None:
+            print(f"Warning: Could not read image: {task[0]}")
+            results.append(None)
+        else:
+            loaded.append((task, img))
 
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    # On the GPU, stack runs of same-shape images into one tall (N*H, W, 3) image so each
+    # run is a single upload. The CPU lookup is per pixel, so stacking would only add a copy.
+    # Morphology stays per image on the CPU so it can't bleed across seams, and only touches
+    # each mask's bounding box.
+    if use_cuda:
+        runs = [list(run) for _, run in groupby(loaded, key=lambda item: item[1].shape)]
+    else:
+        runs = [[item] for item in loaded]
+    for run in runs:
+        n = len(run)
+        h, w = run[0][1].shape[:2]
+        if n == 1:
+            tall = run[0][1]
+        else:
+            stacked = get_buffer("batch", (n, h, w, 3))
+            for i, (_, img) in enumerate(run):
+                stacked[i] = img
+            tall = stacked.reshape(n * h, w, 3)
 
-    # Lanes (light purple -> white)
-    lane_mask = make_mask(hsv, LANE_LOWER, LANE_UPPER)
-    lane_out = save_mask_as_color(lane_mask, WHITE)
+        lane_masks, road_masks = range_masks(tall, use_cuda)
+        lane_masks = lane_masks.reshape(n, h, w)
+        road_masks = road_masks.reshape(n, h, w)
 
-    # Roads (cyan -> grey)
-    road_mask = make_mask(hsv, ROAD_LOWER, ROAD_UPPER)
-    road_out = save_mask_as_color(road_mask, GREY)
+        for i, (task, _) in enumerate(run):
+            results.append((task, *encode_masks(clean_mask(lane_masks[i]), clean_mask(road_masks[i]))))
+    return results
 
-    lanes_out_path = LANES_DIR / img_path.name
-    roads_out_path = ROADS_DIR / img_path.name
 
-    cv2.imwrite(str(lanes_out_path), lane_out)
-    cv2.imwrite(str(roads_out_path), road_out)
+def write_results(batch_results: Iterable[List[Optional[Result]]], total: int) -> None:
+    """Write encoded masks as batches complete, from a thread pool so disk I/O overlaps segmentation."""
+    pending: Deque = deque()
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as writer, \
+            tqdm(total=total, desc="Segmenting") as progress:
+        for results in batch_results:
+            progress.update(len(results))
+            for result in results:
+                if result is None:
+                    continue
+                (_, lane_path, road_path), lane_buf, road_buf = result
+                pending.append(writer.submit(lane_buf.tofile, lane_path))
+                pending.append(writer.submit(road_buf.tofile, road_path))
+            while len(pending) > WRITE_QUEUE_DEPTH:
+                pending.popleft().result()
+        # Surface any write errors before reporting success
+        for future in pending:
+            future.result()
 
 
 def main() -> int:
+    check_opencv_build()
     ensure_dirs()
 
     if not INPUT_DIR.exists():
@@ -97,8 +339,18 @@ def main() -> int:
         print(f"No .jpg images found in {INPUT_DIR}")
         return 0
 
-    for img_path in images:
-        process_image(img_path)
+    # Build every path string once here rather than per image in the workers
+    tasks = [(str(p), str(LANES_DIR / f"{p.stem}.png"), str(ROADS_DIR / f"{p.stem}.png")) for p in images]
+    batches = [tasks[i:i + BATCH_SIZE] for i in range(0, len(tasks), BATCH_SIZE)]
+    if USE_CUDA and cuda_available():
+        # A single process owns the GPU; batches are already large uploads
+        print("Using CUDA for color classification.")
+        write_results(map(partial(process_batch, use_cuda=True), batches), len(images))
+    else:
+        # Fork lets workers inherit the already-imported cv2/numpy and module constants
+        ctx = mp.get_context("fork") if sys.platform.startswith("linux") else mp.get_context()
+        with ctx.Pool(processes=N_PROCESSES, initializer=init_worker) as pool:
+            write_results(pool.imap_unordered(process_batch, batches), len(images))
 
     print(f"Done. Wrote lanes to '{LANES_DIR}' and roads to '{ROADS_DIR}'.")
     return 0
@@ -1,5 +1,10 @@
 import os
+import sys
 import json
+import warnings
+import multiprocessing as mp
+from functools import partial
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
@@ -32,9 +37,79 @@ CLASS_MAPPING = {
     # Add all your class mappings here...
 }
 
+# 6. Set to True if all your images share one resolution (typical for training sets).
+#    Only the first image is probed and its size is reused for every annotation file.
+UNIFORM_IMAGE_SIZE = False
+
 
 # ---------------------
 
+# Label files with fewer lines are parsed line by line, which beats np.loadtxt's fixed overhead
+LOADTXT_MIN_LINES = 32
+
+# CLASS_MAPPING as a lookup table indexed by class number, for the NumPy path
+MAPPED_CLASSES = np.zeros(max(CLASS_MAPPING) + 1, dtype=bool)
+MAPPED_CLASSES[list(CLASS_MAPPING)] = True
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic-coded variants)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_jpeg_size(image_path):
+    """
+    Reads (width, height) from a JPEG's start-of-frame header by walking the marker
+    segments, without decoding the image. Returns None if the file is not a JPEG or
+    no usable frame header is found.
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            byte = f.read(1)
+            while byte and byte != b'\xff':
+                byte = f.read(1)
+            while byte == b'\xff':  # markers may be padded with fill bytes
+                byte = f.read(1)
+            if not byte:
+                return None
+
+            marker = byte[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # standalone markers carry no length
+                continue
+            if marker in (0xD9, 0xDA):  # end of image / start of scan before any frame header
+                return None
+
+            segment_length = f.read(2)
+            if len(segment_length) < 2:
+                return None
+            if marker in JPEG_SOF_MARKERS:
+                header = f.read(5)  # precision, height, width
+                if len(header) < 5:
+                    return None
+                height = int.from_bytes(header[1:3], 'big')
+                width = int.from_bytes(header[3:5], 'big')
+                return (width, height) if width and height else None
+            f.seek(int.from_bytes(segment_length, 'big') - 2, os.SEEK_CUR)
+
+
+def get_image_size(image_path):
+    """
+    Returns (width, height) of an image, or None if it cannot be read.
+    JPEG headers are parsed directly; PIL is the fallback for anything else.
+    """
+    try:
+        size = read_jpeg_size(image_path)
+    except OSError:
+        return None
+    if size is not None:
+        return size
+
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except Exception:
+        return None
+
 
 def yolo_to_box2d(x_center, y_center, width, height, img_width, img_height):
     """
@@ -53,6 +128,126 @@ def yolo_to_box2d(x_center, y_center, width, height, img_width, img_height):
     return x1, y1, x2, y2
 
 
+def _loadtxt_labels(lines):
+    """
+    Parses label lines in one np.loadtxt call into an (N, 5) array. Returns None unless every
+    line is a well-formed label: one row per line keeps row numbers equal to line numbers
+    (np.loadtxt skips blank lines), and the class token must be a plain integer as int()
+    requires (a float parse accepts "1.0").
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # np.loadtxt warns about the blank lines it skips
+            labels = np.loadtxt(lines, dtype=np.float64, comments=None, ndmin=2)
+    except ValueError:
+        return None
+    if labels.shape != (len(lines), 5) or not all(line.split(None, 1)[0].isdecimal() for line in lines):
+        return None
+    return labels
+
+
+def load_yolo_boxes(txt_path, img_width, img_height):
+    """
+    Reads a YOLO .txt file and returns (line_idx, class_no, x1, y1, x2, y2) for every valid
+    line whose class is in CLASS_MAPPING. Files of at least LOADTXT_MIN_LINES well-formed
+    lines are parsed and converted with NumPy; shorter files, where NumPy's fixed overhead
+    outweighs the loop, and files with malformed lines are handled line by line.
+    """
+    with open(txt_path, 'r') as f:
+        lines = f.readlines()
+
+    labels = _loadtxt_labels(lines) if len(lines) >= LOADTXT_MIN_LINES else None
+    if labels is not None:
+        line_ids = np.arange(len(lines))
+        # Bounds are checked on the float column so oversized classes never reach the int cast
+        valid = labels[:, 0] < len(MAPPED_CLASSES)
+        valid[valid] = MAPPED_CLASSES[labels[valid, 0].astype(int)]
+        labels = labels[valid]
+        x1, y1, x2, y2 = yolo_to_box2d(labels[:, 1], labels[:, 2], labels[:, 3], labels[:, 4], img_width, img_height)
+        return list(zip(line_ids[valid].tolist(), labels[:, 0].astype(int).tolist(),
+                        x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist()))
+
+    boxes = []
+    for line_idx, line in enumerate(lines):
+        parts = line.strip().split()
+        if len(parts) != 5:
+            continue
+        try:
+            class_no = int(parts[0])
+            x_center, y_center, norm_w, norm_h = map(float, parts[1:])
+        except ValueError:
+            continue
+        if class_no not in CLASS_MAPPING:
+            continue
+        boxes.append((line_idx, class_no,
+                      *yolo_to_box2d(x_center, y_center, norm_w, norm_h, img_width, img_height)))
+    return boxes
+
+
+def _convert_one(filename, image_size=None):
+    """
+    Converts a single YOLO annotation file to its BDD100K-style JSON file.
+    `image_size` skips probing the image when all images share one resolution.
+    Returns True if a JSON file was written.
+    """
+    base_name = os.path.splitext(filename)[0]
+    image_path = os.path.join(IMAGE_DIR, base_name + IMAGE_EXTENSION)
+
+    if not os.path.exists(image_path):
+        return False
+
+    if image_size is None:
+        image_size = get_image_size(image_path)
+        if image_size is None:
+            return False
+    img_width, img_height = image_size
+
+    txt_path = os.path.join(INPUT_DIR, filename)
+    boxes = load_yolo_boxes(txt_path, img_width, img_height)
+
+    # This list will hold all object dictionaries for the current image
+    objects_list = [
+        {
+            "category": CLASS_MAPPING[class_no],
+            "id": line_idx,
+            "attributes": {
+                "occluded": False,
+                "truncated": False,
+                "trafficLightColor": "none"
+            },
+            "box2d": {"x1": bx1, "y1": by1, "x2": bx2, "y2": by2}
+        }
+        for line_idx, class_no, bx1, by1, bx2, by2 in boxes
+    ]
+
+    # If there are no valid objects, don't create a JSON file
+    if not objects_list:
+        return False
+
+    # Assemble the final JSON structure for the image
+    final_json_structure = {
+        "name": base_name,  # The name is the file name without extension
+        "attributes": {
+            "weather": "undefined",
+            "scene": "undefined",
+            "timeofday": "undefined"
+        },
+        "frames": [
+            {
+                "timestamp": 10000,  # Default timestamp
+                "objects": objects_list
+            }
+        ]
+    }
+
+    # Write the final dictionary to its own JSON file
+    output_json_path = os.path.join(OUTPUT_DIR, base_name + ".json")
+    # json.dumps without indent runs in the C encoder; json.dump / indent fall back to pure Python
+    with open(output_json_path, 'w') as f:
+        f.write(json.dumps(final_json_structure))
+    return True
+
+
 def convert_yolo_to_bdd_frames():
     """
     Converts YOLO annotations to individual BDD100K-style JSON files (one per image),
@@ -75,77 +270,21 @@ def convert_yolo_to_bdd_frames():
 
     print(f"\nFound {len(annotation_files)} annotation files. Starting conversion...")
 
-    for filename in tqdm(annotation_files, desc="Converting files"):
-        base_name = os.path.splitext(filename)[0]
-        image_path = os.path.join(IMAGE_DIR, base_name + IMAGE_EXTENSION)
-
-        if not os.path.exists(image_path):
-            continue
-
-        try:
-            with Image.open(image_path) as img:
-                img_width, img_height = img.size
-        except Exception:
-            continue
-
-        # This list will hold all object dictionaries for the current image
-        objects_list = []
-
-        txt_path = os.path.join(INPUT_DIR, filename)
-        with open(txt_path, 'r') as f:
-            for line_idx, line in enumerate(f):
-                parts = line.strip().split()
-                if len(parts) != 5:
-                    continue
-
-                try:
-                    class_no = int(parts[0])
-                    x_center, y_center, norm_w, norm_h = map(float, parts[1:])
-                except ValueError:
-                    continue
-
-                if class_no not in CLASS_MAPPING:
-                    continue
-
-                x1, y1, x2, y2 = yolo_to_box2d(x_center, y_center, norm_w, norm_h, img_width, img_height)
-
-                # Create the object dictionary in the new format
-                object_dict = {
-                    "category": CLASS_MAPPING[class_no],
-                    "id": line_idx,
-                    "attributes": {
-                        "occluded": False,
-                        "truncated": False,
-                        "trafficLightColor": "none"
-                    },
-                    "box2d": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
-                }
-                objects_list.append(object_dict)
-
-        # If there are no valid objects, don't create a JSON file
-        if not objects_list:
-            continue
-
-        # Assemble the final JSON structure for the image
-        final_json_structure = {
-            "name": base_name,  # The name is the file name without extension
-            "attributes": {
-                "weather": "undefined",
-                "scene": "undefined",
-                "timeofday": "undefined"
-            },
-            "frames": [
-                {
-                    "timestamp": 10000,  # Default timestamp
-                    "objects": objects_list
-                }
-            ]
-        }
+    image_size = None
+    if UNIFORM_IMAGE_SIZE:
+        for filename in annotation_files:
+            image_path = os.path.join(IMAGE_DIR, os.path.splitext(filename)[0] + IMAGE_EXTENSION)
+            if os.path.exists(image_path):
+                image_size = get_image_size(image_path)
+                if image_size is not None:
+                    break
 
-        # Write the final dictionary to its own JSON file
-        output_json_path = os.path.join(OUTPUT_DIR, base_name + ".json")
-        with open(output_json_path, 'w') as f:
-            json.dump(final_json_structure, f, indent=4)  # Use indent=4 to match example
+    # Files are independent; fork lets workers inherit the configuration above
+    ctx = mp.get_context("fork") if sys.platform.startswith("linux") else mp.get_context()
+    with ctx.Pool() as pool:
+        convert = partial(_convert_one, image_size=image_size)
+        list(tqdm(pool.imap_unordered(convert, annotation_files, chunksize=64),
+                  total=len(annotation_files), desc="Converting files"))
 
     print(f"\nConversion complete! ✨ Check the '{OUTPUT_DIR}' directory.")
 